@@ -1,7 +1,11 @@
 import uuid
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
+import anyio.to_thread
+from fastapi import FastAPI, Request, Response
+from starlette.background import BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
 
 from core.monzo_client import MonzoClient, build_session
 from core.settings import load_settings
@@ -9,31 +13,113 @@ from core.webhook_service import WebhookService
 from stores.factory import build_state_store
 
 
-app = FastAPI(title="Monzo Balance Bot")
-
 settings = load_settings()
 store = build_state_store(settings)
-monzo_client = MonzoClient(build_session(), settings.request_timeout)
+monzo_client = MonzoClient(build_session(settings.http_pool_size), settings.request_timeout)
 service = WebhookService(settings, monzo_client, store)
 
+# The webhook only ever answers with a handful of fixed bodies, so build those responses once.
+_RESPONSES = {
+    (status_code, body): Response(body, status_code=status_code, media_type="text/plain")
+    for status_code, body in (
+        (200, b"Received"),
+        (200, b"Duplicate"),
+        (200, b"Error processed"),
+        (400, b"Invalid JSON"),
+        (401, b"Unauthorized"),
+        (413, b"Payload too large"),
+    )
+}
 
-@app.post("/monzo_webhook")
-async def monzo_webhook(request: Request) -> PlainTextResponse:
-    correlation_id = request.headers.get("X-Correlation-ID") or str(uuid.uuid4())
+
+def _text_response(status_code: int, body: bytes, background: BackgroundTasks | None = None) -> Response:
+    # Cached responses are shared, so only use them when nothing per-request (background work) is attached.
+    cached = _RESPONSES.get((status_code, body)) if background is None else None
+    if cached is not None:
+        return cached
+    return Response(body, status_code=status_code, media_type="text/plain", background=background)
+
+
+async def _read_body(request: Request, limit: int) -> bytes | None:
+    """Read the request body, returning ``None`` as soon as it exceeds ``limit`` bytes."""
     try:
-        body = await request.json()
-    except Exception:
-        return PlainTextResponse("Invalid JSON", status_code=400, headers={"X-Correlation-ID": correlation_id})
-
-    result = service.handle_webhook(
-        headers=dict(request.headers),
-        query=dict(request.query_params),
-        body=body,
+        declared = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        declared = 0
+    if declared > limit:
+        return None
+
+    buf = bytearray()
+    async for chunk in request.stream():
+        buf += chunk
+        if len(buf) > limit:
+            return None
+    return bytes(buf)
+
+
+class CorrelationIdMiddleware:
+    """Resolve the request's X-Correlation-ID once and echo it on every response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        correlation_id = Headers(scope=scope).get("x-correlation-id") or str(uuid.uuid4())
+        scope.setdefault("state", {})["correlation_id"] = correlation_id
+        header = (b"x-correlation-id", correlation_id.encode("latin-1"))
+
+        async def send_with_correlation_id(message):
+            if message["type"] == "http.response.start":
+                # Copy rather than append: cached responses share their header list.
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_correlation_id)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Webhooks run on anyio's worker threads; size the pool for concurrent Monzo round-trips.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.worker_threads
+    service.start_warm_up()
+    yield
+
+
+app = FastAPI(title="Monzo Balance Bot", lifespan=lifespan)
+app.add_middleware(CorrelationIdMiddleware)
+
+
+@app.post("/monzo_webhook")
+async def monzo_webhook(request: Request) -> Response:
+    correlation_id = request.state.correlation_id
+    raw = await _read_body(request, settings.max_body_bytes)
+    if raw is None:
+        return _text_response(413, b"Payload too large")
+
+    # The service is shared with the sync Azure adapter and blocks on Monzo/storage I/O,
+    # so run it on a worker thread to keep the event loop free for other webhooks.
+    result = await run_in_threadpool(
+        service.handle_raw_webhook,
+        headers=request.headers,
+        query=request.query_params,
+        raw=raw,
         correlation_id=correlation_id,
+        defer_side_effects=True,
     )
-    return PlainTextResponse(result.body, status_code=result.status_code, headers={"X-Correlation-ID": correlation_id})
+
+    # Feed posts and note updates do not affect the reply, so send them after responding to Monzo.
+    background = None
+    if result.deferred:
+        background = BackgroundTasks()
+        background.add_task(service.run_alert_tasks, result.deferred)
+    return _text_response(result.status_code, result.body, background)
 
 
 @app.get("/health")
 async def health() -> dict[str, str]:
+    service.start_warm_up(min_interval=60)
     return {"status": "ok"}
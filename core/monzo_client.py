@@ -1,22 +1,65 @@
 from __future__ import annotations
 
+import socket
+
 import requests
 from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 from urllib3.util.retry import Retry
 
 
 MONZO_API = "https://api.monzo.com"
+TOKEN_URL = f"{MONZO_API}/oauth2/token"
+BALANCE_URL = f"{MONZO_API}/balance"
+FEED_URL = f"{MONZO_API}/feed"
+TRANSACTIONS_URL = f"{MONZO_API}/transactions/"
+PING_URL = f"{MONZO_API}/ping/whoami"
+
+# Feed item fields that never change between alerts.
+_FEED_STATIC_FIELDS = {
+    "type": "basic",
+    "params[image_url]": "https://cdn-icons-png.flaticon.com/512/564/564619.png",
+    "params[title_color]": "#333333",
+}
+
+# urllib3 already sets TCP_NODELAY; SO_KEEPALIVE stops idle pooled sockets being silently dropped by NAT between webhooks.
+_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+# Longest Retry-After a rate-limited read will wait for; a webhook cannot sit out a long throttle window.
+_MAX_RETRY_AFTER_SECONDS = 2.0
+
 
+class _CappedRetry(Retry):
+    """Honour Retry-After on 429/503, but never sleep longer than ``_MAX_RETRY_AFTER_SECONDS``."""
 
-def build_session() -> requests.Session:
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, _MAX_RETRY_AFTER_SECONDS)
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault("socket_options", _SOCKET_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+
+
+def build_session(pool_size: int = 50) -> requests.Session:
     session = requests.Session()
-    retries = Retry(
-        total=3,
-        backoff_factor=1,
+    # Only idempotent reads are retried, briefly: a retried token POST can burn the refresh token, and a
+    # retried feed POST duplicates the alert. A failed /balance read drops the alert (the webhook is still
+    # acknowledged), so rate-limited reads are retried too, after the server's Retry-After.
+    retries = _CappedRetry(
+        total=2,
+        backoff_factor=0.2,
         status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET", "POST", "PATCH", "PUT"],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
     )
-    adapter = HTTPAdapter(max_retries=retries, pool_connections=10, pool_maxsize=10)
+    # Size the keep-alive pool for concurrent webhooks so bursts reuse warm TLS connections.
+    adapter = _KeepAliveAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False)
     session.mount("https://", adapter)
     return session
 
@@ -25,10 +68,27 @@ class MonzoClient:
     def __init__(self, session: requests.Session, timeout: tuple[float, float]):
         self.session = session
         self.timeout = timeout
+        # (access_token, headers) for the most recent token; tokens live for hours, so this nearly always hits.
+        self._auth_headers: tuple[str, dict[str, str]] | None = None
+
+    def _auth(self, access_token: str) -> dict[str, str]:
+        cached = self._auth_headers
+        if cached and cached[0] == access_token:
+            return cached[1]
+        headers = {"Authorization": f"Bearer {access_token}"}
+        self._auth_headers = (access_token, headers)
+        return headers
+
+    def warm_up(self) -> None:
+        """Resolve the API host and leave a TLS connection in the pool; failures are ignored."""
+        try:
+            self.session.get(PING_URL, timeout=self.timeout)
+        except requests.RequestException:
+            pass
 
     def refresh_token(self, client_id: str, client_secret: str, refresh_token: str) -> requests.Response:
         return self.session.post(
-            f"{MONZO_API}/oauth2/token",
+            TOKEN_URL,
             data={
                 "grant_type": "refresh_token",
                 "client_id": client_id,
@@ -40,40 +100,38 @@ class MonzoClient:
 
     def get_balance(self, access_token: str, account_id: str) -> requests.Response:
         return self.session.get(
-            f"{MONZO_API}/balance",
-            headers={"Authorization": f"Bearer {access_token}"},
+            BALANCE_URL,
+            headers=self._auth(access_token),
             params={"account_id": account_id},
             timeout=self.timeout,
         )
 
     def get_transaction(self, access_token: str, tx_id: str) -> requests.Response:
         return self.session.get(
-            f"{MONZO_API}/transactions/{tx_id}",
-            headers={"Authorization": f"Bearer {access_token}"},
+            TRANSACTIONS_URL + tx_id,
+            headers=self._auth(access_token),
             timeout=self.timeout,
         )
 
     def post_feed(self, access_token: str, account_id: str, click_url: str, title: str, body: str, color: str) -> None:
         self.session.post(
-            f"{MONZO_API}/feed",
-            headers={"Authorization": f"Bearer {access_token}"},
+            FEED_URL,
+            headers=self._auth(access_token),
             data={
+                **_FEED_STATIC_FIELDS,
                 "account_id": account_id,
-                "type": "basic",
                 "url": click_url,
                 "params[title]": title,
                 "params[body]": body,
-                "params[image_url]": "https://cdn-icons-png.flaticon.com/512/564/564619.png",
                 "params[background_color]": color,
-                "params[title_color]": "#333333",
             },
             timeout=self.timeout,
         )
 
     def patch_transaction_note(self, access_token: str, tx_id: str, note: str) -> None:
         self.session.patch(
-            f"{MONZO_API}/transactions/{tx_id}",
-            headers={"Authorization": f"Bearer {access_token}"},
+            TRANSACTIONS_URL + tx_id,
+            headers=self._auth(access_token),
             data={"metadata[notes]": note},
             timeout=self.timeout,
         )
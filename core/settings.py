@@ -1,10 +1,12 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 
 
 def _get_env(*keys: str, default=None):
+    env = os.environ
     for key in keys:
-        value = os.getenv(key)
+        value = env.get(key)
         if value is not None and value != "":
             return value
     return default
@@ -17,7 +19,7 @@ def _env_bool(*keys: str, default: bool = False) -> bool:
     return str(value).strip().lower() in {"1", "true", "yes", "y", "on"}
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Settings:
     monzo_client_id: str | None
     monzo_client_secret: str | None
@@ -36,9 +38,43 @@ class Settings:
     seen_ttl: int
     # Backwards-compatible default: Monzo usually authenticates webhooks via query-string secret.
     allow_query_secret: bool = True
+    worker_threads: int = 64
+    # A transaction.created payload is a few KiB; anything far larger is not from Monzo.
+    max_body_bytes: int = 64 * 1024
+    http_pool_size: int = 50
+    # Optional: share transaction dedupe across workers/instances through Redis.
+    redis_url: str | None = None
+    # Seconds to wait on Redis connects and replies before falling back to the state store's own dedupe.
+    redis_timeout: float = 0.5
+    # Re-fetch each transaction from Monzo before alerting; the webhook secret already authenticates the payload.
+    verify_transactions: bool = True
+    # Create the state table on first use; turn off when it is provisioned ahead of time to skip that round-trip.
+    ensure_table: bool = True
+    # Derived: the secret encoded once, so each webhook auth check compares bytes without re-encoding it.
+    webhook_secret_bytes: bytes | None = field(default=None, init=False, repr=False, compare=False)
 
+    def __post_init__(self):
+        secret_bytes = self.webhook_secret.encode("utf-8") if self.webhook_secret else None
+        object.__setattr__(self, "webhook_secret_bytes", secret_bytes)
 
+
+# Settings the webhook cannot work without, mapped to the environment variable documented for each.
+_REQUIRED = {
+    "monzo_client_id": "MONZOCLIENTID",
+    "monzo_client_secret": "MONZOCLIENTSECRET",
+    "monzo_account_id": "MONZOACCOUNTID",
+    "webhook_secret": "WEBHOOKSECRET",
+}
+
+
+def missing_required_settings(settings: Settings) -> list[str]:
+    """Return the environment variable names of required settings that are unset."""
+    return [env_name for attr, env_name in _REQUIRED.items() if not getattr(settings, attr)]
+
+
+@lru_cache(maxsize=1)
 def load_settings() -> Settings:
+    """Read settings from the environment once per process; call ``load_settings.cache_clear()`` to re-read."""
     return Settings(
         monzo_client_id=_get_env("MONZO_CLIENT_ID", "MONZOCLIENTID"),
         monzo_client_secret=_get_env("MONZO_CLIENT_SECRET", "MONZOCLIENTSECRET"),
@@ -56,4 +92,11 @@ def load_settings() -> Settings:
         partition_key="monzo",
         row_key="bot",
         seen_ttl=600,
+        worker_threads=int(_get_env("WORKER_THREADS", default=64)),
+        max_body_bytes=int(_get_env("MAX_BODY_BYTES", default=64 * 1024)),
+        http_pool_size=int(_get_env("HTTP_POOL_SIZE", default=50)),
+        redis_url=_get_env("REDIS_URL"),
+        redis_timeout=float(_get_env("REDIS_TIMEOUT", default=0.5)),
+        verify_transactions=_env_bool("VERIFY_TRANSACTIONS", default=True),
+        ensure_table=_env_bool("ENSURE_TABLE", default=True),
     )
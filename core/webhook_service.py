@@ -1,25 +1,56 @@
 from __future__ import annotations
 
+import hashlib
+import hmac
 import logging
 import random
 import secrets
+import threading
 import time
 import uuid
-from dataclasses import dataclass
+from collections.abc import Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Any
 
+import orjson
+
 from core.monzo_client import MonzoClient
-from core.settings import Settings
+from core.settings import Settings, missing_required_settings
 from stores.interfaces import AlertState, ConcurrencyError, TokenState
 
 
 logger = logging.getLogger(__name__)
 
+TRANSACTION_CREATED = "transaction.created"
+_TRANSACTION_CREATED_MARKER = b'"transaction.created"'
+
+_HOME_DEEP_LINK = "monzo://home"
+# NOTE: The app expects the plural route, not `monzo://transaction/{id}`.
+_TRANSACTION_DEEP_LINK_PREFIX = "monzo://transactions/"
+
+
+def fast_probe_type(raw: bytes) -> str | None:
+    """Return ``"transaction.created"`` if the raw payload may be that event, else ``None``.
+
+    This is a byte scan, not a parse: a hit still needs the parsed ``type`` to confirm it.
+    """
+    if _TRANSACTION_CREATED_MARKER in raw:
+        return TRANSACTION_CREATED
+    return None
+
+
+def _json(resp) -> Any:
+    """Decode a Monzo response body with orjson rather than the stdlib-backed ``Response.json()``."""
+    return orjson.loads(resp.content)
+
 
 @dataclass
 class WebhookResult:
     status_code: int
-    body: str
+    body: bytes
+    # Alert side effects left for the adapter to run after responding, via ``WebhookService.run_alert_tasks``.
+    deferred: list[Callable[[], None]] = field(default_factory=list)
 
 
 class WebhookService:
@@ -27,47 +58,138 @@ class WebhookService:
         self.settings = settings
         self.monzo_client = monzo_client
         self.store = store
+        missing = missing_required_settings(settings)
+        self._configured = not missing
+        self._last_warm_up: float | None = None
+        if missing:
+            # Checked once at startup rather than per webhook; requests will fail until these are set.
+            logger.error("event=config_missing vars=%s", ",".join(missing))
+        # (access_token, valid_until) kept in-process so warm requests skip the store read.
+        self._token_cache: tuple[str, float] | None = None
+        # Single-flight guard: one thread refreshes while concurrent callers wait for its result.
+        self._refresh_lock = threading.Lock()
+        # Runs Monzo calls that can overlap with the request thread's own round-trip.
+        self._executor = ThreadPoolExecutor(max_workers=settings.worker_threads, thread_name_prefix="monzo-io")
+
+    def start_warm_up(self, min_interval: float = 0.0) -> None:
+        """Open a Monzo connection in the background so the next webhook skips DNS and the TLS handshake.
+
+        Does nothing if the last warm-up started less than ``min_interval`` seconds ago, so the
+        regular health probes can call it to keep the connection from going cold between webhooks.
+        """
+        if not self._configured:
+            return
+        now = time.monotonic()
+        if self._last_warm_up is not None and now - self._last_warm_up < min_interval:
+            return
+        self._last_warm_up = now
+        self._executor.submit(self.monzo_client.warm_up)
 
     def handle_webhook(
         self,
-        headers: dict[str, str],
-        query: dict[str, str],
+        headers: Mapping[str, str],
+        query: Mapping[str, str],
         body: dict[str, Any],
         correlation_id: str | None = None,
+        defer_side_effects: bool = False,
     ) -> WebhookResult:
+        """Authenticate and process a webhook.
+
+        ``headers`` must be case-insensitive (as both runtime adapters provide) or use lower-case keys.
+        With ``defer_side_effects`` the feed post and note update are returned in
+        ``WebhookResult.deferred`` instead of being sent before returning.
+        """
         cid = correlation_id or str(uuid.uuid4())
-        secret_header = headers.get("X-Webhook-Secret") or headers.get("x-webhook-secret")
+        if not self._is_authorized(headers, query):
+            logger.warning("event=webhook_unauthorized cid=%s", cid)
+            return WebhookResult(401, b"Unauthorized")
+        return self._process_event(body, cid, defer_side_effects)
+
+    def handle_raw_webhook(
+        self,
+        headers: Mapping[str, str],
+        query: Mapping[str, str],
+        raw: bytes,
+        correlation_id: str | None = None,
+        defer_side_effects: bool = False,
+    ) -> WebhookResult:
+        """Like ``handle_webhook`` but takes the undecoded body.
+
+        Authentication runs before any parsing, and events other than ``transaction.created``
+        are acknowledged without decoding the JSON at all. Besides the shared secret, a caller
+        (e.g. a signing gateway) may authenticate with ``X-Webhook-Signature``: the hex
+        HMAC-SHA256 of the raw body keyed with the webhook secret.
+        """
+        cid = correlation_id or str(uuid.uuid4())
+        signature = headers.get("x-webhook-signature")
+        authorized = self._is_signed(raw, signature) if signature else self._is_authorized(headers, query)
+        if not authorized:
+            logger.warning("event=webhook_unauthorized cid=%s", cid)
+            return WebhookResult(401, b"Unauthorized")
+        if fast_probe_type(raw) is None:
+            return WebhookResult(200, b"Received")
+        try:
+            body = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return WebhookResult(400, b"Invalid JSON")
+        if not isinstance(body, dict):
+            return WebhookResult(400, b"Invalid JSON")
+        return self._process_event(body, cid, defer_side_effects)
+
+    def _is_signed(self, raw: bytes, signature: str) -> bool:
+        secret = self.settings.webhook_secret_bytes
+        if not secret:
+            return False
+        expected = hmac.new(secret, raw, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected.encode("ascii"), signature.strip().lower().encode("utf-8"))
+
+    def _is_authorized(self, headers: Mapping[str, str], query: Mapping[str, str]) -> bool:
+        secret_header = headers.get("x-webhook-secret")
         # Monzo commonly sends shared secret via query string; keep this toggleable for hardening.
         secret_query = query.get("secret_key") if self.settings.allow_query_secret else None
         provided_secret = secret_header or secret_query
-        env_secret = self.settings.webhook_secret
-
-        if not provided_secret or not env_secret or not secrets.compare_digest(provided_secret, env_secret):
-            logger.warning("event=webhook_unauthorized cid=%s", cid)
-            return WebhookResult(401, "Unauthorized")
+        secret = self.settings.webhook_secret_bytes
+        if not provided_secret or not secret:
+            return False
+        return secrets.compare_digest(provided_secret.encode("utf-8"), secret)
 
-        if body.get("type") == "transaction.created":
+    def _process_event(self, body: dict[str, Any], cid: str, defer_side_effects: bool = False) -> WebhookResult:
+        if body.get("type") == TRANSACTION_CREATED:
             tx = body.get("data", {})
             tx_id = tx.get("id")
             if tx_id and self.store.seen(tx_id, self.settings.seen_ttl):
                 logger.info("event=webhook_duplicate cid=%s tx_id=%s", cid, tx_id)
-                return WebhookResult(200, "Duplicate")
+                return WebhookResult(200, b"Duplicate")
 
+            deferred: list[Callable[[], None]] = []
             try:
-                self.check_and_alert(tx, cid)
+                self.check_and_alert(tx, cid, deferred=deferred if defer_side_effects else None)
             except Exception as exc:
                 logger.exception("event=webhook_logic_error cid=%s error=%s", cid, exc)
-                return WebhookResult(200, "Error processed")
+                return WebhookResult(200, b"Error processed")
+            return WebhookResult(200, b"Received", deferred)
 
-        return WebhookResult(200, "Received")
+        return WebhookResult(200, b"Received")
 
     def get_monzo_access_token(self) -> str:
         if not self.settings.monzo_client_id or not self.settings.monzo_client_secret:
             raise ValueError("Missing MONZO client credentials in environment.")
 
+        cached = self._token_cache
+        if cached and time.time() < cached[1]:
+            return cached[0]
+
+        with self._refresh_lock:
+            cached = self._token_cache
+            if cached and time.time() < cached[1]:
+                return cached[0]
+            return self._load_or_refresh_token()
+
+    def _load_or_refresh_token(self) -> str:
         for _ in range(3):
             state = self.store.get_token_state()
             if state.access_token and time.time() < state.expiry_ts:
+                self._cache_token(state.access_token, state.expiry_ts)
                 return state.access_token
 
             refresh_token = state.refresh_token or self.settings.monzo_refresh_token
@@ -86,7 +208,7 @@ class WebhookService:
                 continue
 
             resp.raise_for_status()
-            tokens = resp.json()
+            tokens = _json(resp)
             new_state = TokenState(
                 access_token=tokens["access_token"],
                 refresh_token=tokens["refresh_token"],
@@ -94,6 +216,7 @@ class WebhookService:
             )
             try:
                 self.store.save_token_state(new_state, etag=state.etag)
+                self._cache_token(tokens["access_token"], new_state.expiry_ts)
                 return new_state.access_token or ""
             except ConcurrencyError:
                 logger.info("Race condition detected (ETag mismatch). Retrying read...")
@@ -102,33 +225,48 @@ class WebhookService:
 
         raise RuntimeError("Failed to obtain access token after max retries")
 
-    def check_and_alert(self, transaction_data: dict[str, Any], correlation_id: str | None = None) -> None:
+    def _cache_token(self, access_token: str, expiry_ts: float) -> None:
+        valid_until = min(expiry_ts, time.time() + self.settings.token_cache_ttl)
+        self._token_cache = (access_token, valid_until)
+
+    def check_and_alert(
+        self,
+        transaction_data: dict[str, Any],
+        correlation_id: str | None = None,
+        deferred: list[Callable[[], None]] | None = None,
+    ) -> None:
+        """Evaluate the balance and alert; with ``deferred`` the alert calls are queued there instead."""
         cid = correlation_id or str(uuid.uuid4())
         account_id = self.settings.monzo_account_id
         if transaction_data.get("account_id") != account_id:
             logger.info("event=webhook_irrelevant_account cid=%s", cid)
             return
 
-        access_token = self.get_monzo_access_token()
         tx_id = transaction_data.get("id")
         if not tx_id:
             logger.warning("event=tx_missing_id cid=%s", cid)
             return
 
-        if not self.verify_transaction(tx_id, account_id or "", access_token, cid):
-            logger.warning("event=tx_verification_failed cid=%s tx_id=%s", cid, tx_id)
+        # Declines never move money, so they need no token or any Monzo call.
+        if transaction_data.get("decline_reason"):
+            logger.info("event=tx_declined cid=%s tx_id=%s", cid, tx_id)
             return
+        # Credits cannot lower the balance, but they still run so a recovered balance lowers the alert level.
+        amount = transaction_data.get("amount")
+        is_credit = isinstance(amount, int) and amount >= 0
 
-        try:
-            resp = self.monzo_client.get_balance(access_token, account_id or "")
-            resp.raise_for_status()
-        except Exception as exc:
-            logger.error("event=balance_check_failed cid=%s error=%s", cid, exc)
+        # Only now, with a webhook we would act on, pay for a token (and possibly a refresh).
+        access_token = self.get_monzo_access_token()
+
+        # The balance and alert-state reads do not depend on verification, so overlap the round-trips.
+        balance_future = self._executor.submit(self._fetch_balance, access_token, account_id or "", cid)
+        alert_state_future = self._executor.submit(self.store.get_alert_state)
+        if self.settings.verify_transactions and not self.verify_transaction(tx_id, account_id or "", access_token, cid):
+            logger.warning("event=tx_verification_failed cid=%s tx_id=%s", cid, tx_id)
             return
 
-        balance = resp.json().get("balance")
+        balance = balance_future.result()
         if balance is None:
-            logger.error("event=balance_missing_field cid=%s", cid)
             return
 
         current_state_level = 0
@@ -137,8 +275,51 @@ class WebhookService:
         elif balance < self.settings.balance_limit_warning:
             current_state_level = 1
 
-        alert_state: AlertState = self.store.get_alert_state()
+        alert_state: AlertState = alert_state_future.result()
+        fresh = False
+        for _ in range(3):
+            new_state, should_alert = self._next_alert_state(current_state_level, alert_state, cid, credit=is_credit)
+            if new_state == alert_state:
+                # Skipping the write also skips its ETag check, so confirm a possibly cached state against the row first.
+                if fresh:
+                    break
+                alert_state, fresh = self.store.get_alert_state(fresh=True), True
+                new_state, should_alert = self._next_alert_state(current_state_level, alert_state, cid, credit=is_credit)
+                if new_state == alert_state:
+                    break
+            try:
+                self.store.save_alert_state(new_state)
+                break
+            except ConcurrencyError:
+                logger.info("event=alert_state_conflict cid=%s", cid)
+                alert_state, fresh = self.store.get_alert_state(fresh=True), True
+            except Exception as exc:
+                logger.warning("event=alert_state_save_failed cid=%s error=%s", cid, exc)
+                break
+        else:
+            # The state this alert would be based on was never stored; the next webhook recomputes it.
+            logger.warning("event=alert_state_save_failed cid=%s error=too many conflicts", cid)
+            return
+
+        if should_alert:
+            prefix = "BALANCE CRITICAL" if current_state_level == 2 else "BALANCE WARNING"
+            color = "#E74C3C" if current_state_level == 2 else "#F1C40F"
+            tasks = self._alert_tasks(access_token, account_id or "", transaction_data, balance, prefix, color, cid)
+            if deferred is None:
+                self.run_alert_tasks(tasks)
+            else:
+                deferred.extend(tasks)
+
+    def _next_alert_state(
+        self, current_state_level: int, alert_state: AlertState, cid: str, credit: bool = False
+    ) -> tuple[AlertState, bool]:
+        """Return the alert state after this transaction and whether it should alert.
+
+        A ``credit`` only ever lowers the level: it neither alerts nor advances the reminder counter.
+        """
         prev_state_level = alert_state.last_state_level
+        if credit and current_state_level >= prev_state_level:
+            return alert_state, False
         alert_counter = alert_state.alert_counter
         should_alert = False
 
@@ -159,15 +340,20 @@ class WebhookService:
             alert_counter = 0
             logger.info("event=alert_state_improved cid=%s from=%s to=%s", cid, prev_state_level, current_state_level)
 
+        return AlertState(last_state_level=current_state_level, alert_counter=alert_counter), should_alert
+
+    def _fetch_balance(self, access_token: str, account_id: str, cid: str) -> int | None:
         try:
-            self.store.save_alert_state(AlertState(last_state_level=current_state_level, alert_counter=alert_counter))
+            resp = self.monzo_client.get_balance(access_token, account_id)
+            resp.raise_for_status()
         except Exception as exc:
-            logger.warning("event=alert_state_save_failed cid=%s error=%s", cid, exc)
+            logger.error("event=balance_check_failed cid=%s error=%s", cid, exc)
+            return None
 
-        if should_alert:
-            prefix = "BALANCE CRITICAL" if current_state_level == 2 else "BALANCE WARNING"
-            color = "#E74C3C" if current_state_level == 2 else "#F1C40F"
-            self.send_alert(access_token, account_id or "", transaction_data, balance, prefix, color, cid)
+        balance = _json(resp).get("balance")
+        if balance is None:
+            logger.error("event=balance_missing_field cid=%s", cid)
+        return balance
 
     def verify_transaction(self, tx_id: str, account_id: str, access_token: str, correlation_id: str | None = None) -> bool:
         cid = correlation_id or str(uuid.uuid4())
@@ -178,7 +364,7 @@ class WebhookService:
             logger.error("event=tx_verify_request_failed cid=%s tx_id=%s error=%s", cid, tx_id, exc)
             return False
 
-        tx = resp.json().get("transaction", {})
+        tx = _json(resp).get("transaction", {})
         if not tx:
             logger.error("event=tx_verify_empty_payload cid=%s tx_id=%s", cid, tx_id)
             return False
@@ -190,9 +376,8 @@ class WebhookService:
     def build_transaction_click_url(self, tx_id: str | None) -> str:
         """Build a transaction deep-link used in Monzo feed items."""
         if not tx_id:
-            return "monzo://home"
-        # NOTE: The app expects the plural route, not `monzo://transaction/{id}`.
-        return f"monzo://transactions/{tx_id}"
+            return _HOME_DEEP_LINK
+        return _TRANSACTION_DEEP_LINK_PREFIX + tx_id
 
     def send_alert(
         self,
@@ -204,6 +389,27 @@ class WebhookService:
         color: str,
         correlation_id: str | None = None,
     ) -> None:
+        self.run_alert_tasks(self._alert_tasks(access_token, account_id, tx_data, balance, prefix, color, correlation_id))
+
+    def run_alert_tasks(self, tasks: list[Callable[[], None]]) -> None:
+        """Run independent alert calls side by side: all but the last on the pool, the last on this thread."""
+        if not tasks:
+            return
+        futures = [self._executor.submit(task) for task in tasks[:-1]]
+        tasks[-1]()
+        for future in futures:
+            future.result()
+
+    def _alert_tasks(
+        self,
+        access_token: str,
+        account_id: str,
+        tx_data: dict[str, Any],
+        balance: int,
+        prefix: str,
+        color: str,
+        correlation_id: str | None = None,
+    ) -> list[Callable[[], None]]:
         cid = correlation_id or str(uuid.uuid4())
         merchant = tx_data.get("merchant", {}).get("name") if tx_data.get("merchant") else tx_data.get("description", "Unknown")
         fmt_bal = f"£{balance / 100:.2f}"
@@ -212,13 +418,16 @@ class WebhookService:
         tx_id = tx_data.get("id")
         click_url = self.build_transaction_click_url(tx_id)
 
-        try:
-            self.monzo_client.post_feed(access_token, account_id, click_url, title, body, color)
-        except Exception as exc:
-            logger.error("event=feed_send_failed cid=%s error=%s", cid, exc)
+        def post_feed() -> None:
+            try:
+                self.monzo_client.post_feed(access_token, account_id, click_url, title, body, color)
+            except Exception as exc:
+                logger.error("event=feed_send_failed cid=%s error=%s", cid, exc)
 
-        if tx_id:
+        def patch_note() -> None:
             try:
                 self.monzo_client.patch_transaction_note(access_token, tx_id, title)
             except Exception as exc:
                 logger.warning("event=tx_note_update_failed cid=%s tx_id=%s error=%s", cid, tx_id, exc)
+
+        return [post_feed, patch_note] if tx_id else [post_feed]
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import uuid
 
@@ -16,22 +17,23 @@ app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
 settings = load_settings()
 store = build_state_store(settings)
-monzo_client = MonzoClient(build_session(), settings.request_timeout)
+monzo_client = MonzoClient(build_session(settings.http_pool_size), settings.request_timeout)
 service = WebhookService(settings, monzo_client, store)
+service.start_warm_up()
 
 
 @app.route(route="monzo_webhook", methods=["POST"])
-def monzo_webhook(req: func.HttpRequest) -> func.HttpResponse:
+async def monzo_webhook(req: func.HttpRequest) -> func.HttpResponse:
     correlation_id = req.headers.get("X-Correlation-ID") or str(uuid.uuid4())
-    try:
-        body = req.get_json()
-    except ValueError:
-        return func.HttpResponse("Invalid JSON", status_code=400, headers={"X-Correlation-ID": correlation_id})
-
-    result = service.handle_webhook(
-        headers=dict(req.headers),
-        query=dict(req.params),
-        body=body,
+
+    # Async handlers are not bound to the worker's sync threadpool; the blocking service
+    # work runs on a thread so concurrent deliveries on this instance overlap.
+    result = await asyncio.to_thread(
+        service.handle_raw_webhook,
+        # Both are read-only mappings already (headers case-insensitive), so pass them without copying.
+        headers=req.headers,
+        query=req.params,
+        raw=req.get_body(),
         correlation_id=correlation_id,
     )
     return func.HttpResponse(result.body, status_code=result.status_code, headers={"X-Correlation-ID": correlation_id})
@@ -39,4 +41,5 @@ def monzo_webhook(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.route(route="health", methods=["GET"])
 def health(req: func.HttpRequest) -> func.HttpResponse:
+    service.start_warm_up(min_interval=60)
     return func.HttpResponse('{"status":"ok"}', status_code=200, mimetype="application/json")
@@ -2,13 +2,9 @@
 import os
 import logging
 import secrets
-import threading
-import webbrowser
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs, urlencode
 
-import requests
-
 # ---------- LOGGING ----------
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
@@ -21,6 +17,13 @@ REDIRECT_URI = "http://localhost:8080/callback"
 AUTH_URL = "https://auth.monzo.com"
 API_URL = "https://api.monzo.com"
 
+# Everything in the login URL but the per-run state is fixed, so encode it once.
+_STATIC_LOGIN_PREFIX = (
+    f"{AUTH_URL}/?" + urlencode({"client_id": CLIENT_ID, "redirect_uri": REDIRECT_URI, "response_type": "code"})
+    if CLIENT_ID
+    else None
+)
+
 # Global state
 server_instance = None
 state_token = None
@@ -74,15 +77,18 @@ class RequestHandler(BaseHTTPRequestHandler):
 
 def exchange_token(auth_code: str) -> None:
     """Exchange authorization code for access and refresh tokens."""
-    global server_instance
+    # Imported lazily: requests is only needed once the browser flow calls back.
+    import requests
 
     if not CLIENT_ID or not CLIENT_SECRET:
         logger.error("CLIENT_ID or CLIENT_SECRET not set")
         return
 
     logger.info("Exchanging authorization code for tokens...")
+    # One session so the whoami check reuses the token call's TLS connection.
+    session = requests.Session()
     try:
-        resp = requests.post(
+        resp = session.post(
             f"{API_URL}/oauth2/token",
             data={
                 "grant_type": "authorization_code",
@@ -116,7 +122,7 @@ def exchange_token(auth_code: str) -> None:
         # Optional: one-time whoami check to validate token
         if access_token:
             try:
-                wi = requests.get(
+                wi = session.get(
                     f"{API_URL}/ping/whoami",
                     headers={"Authorization": f"Bearer {access_token}"},
                     timeout=10,
@@ -129,30 +135,23 @@ def exchange_token(auth_code: str) -> None:
     except requests.exceptions.RequestException as e:
         logger.error("Request error during token exchange: %s", e)
     finally:
-        # Stop the local server once we have finished
-        if server_instance:
-            threading.Thread(target=server_instance.shutdown, daemon=True).start()
+        session.close()
 
 
 def get_monzo_refresh_token() -> None:
     """Run the OAuth flow locally and obtain a refresh token."""
     global state_token, server_instance
 
-    if not CLIENT_ID or not CLIENT_SECRET or "oauth2client_" not in CLIENT_ID:
+    if not CLIENT_ID or not CLIENT_SECRET or not CLIENT_ID.startswith("oauth2client_"):
         logger.error("Set MONZO_CLIENT_ID and MONZO_CLIENT_SECRET, or paste values in the script.")
         return
 
     # Build the login URL correctly
     state_token = secrets.token_urlsafe(32)
-    params = urlencode(
-        {
-            "client_id": CLIENT_ID,
-            "redirect_uri": REDIRECT_URI,
-            "response_type": "code",
-            "state": state_token,
-        }
-    )
-    login_url = f"{AUTH_URL}/?{params}"
+    # token_urlsafe output needs no further escaping.
+    login_url = f"{_STATIC_LOGIN_PREFIX}&state={state_token}"
+
+    import webbrowser
 
     logger.info("Opening browser to: %s", login_url)
     webbrowser.open(login_url, new=2)
@@ -162,7 +161,7 @@ def get_monzo_refresh_token() -> None:
     server_instance = HTTPServer((server_host, server_port), RequestHandler)
     logger.info("Waiting for OAuth callback on %s ...", REDIRECT_URI)
 
-    # Handle exactly one request, up to 5 minutes
+    # Handle exactly one request, up to 5 minutes; handle_request returns after it, so no shutdown is needed
     server_instance.timeout = 300
     server_instance.handle_request()
     server_instance.server_close()
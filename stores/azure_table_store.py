@@ -1,71 +1,164 @@
 from __future__ import annotations
 
 import os
+import threading
 import time
-from typing import Optional
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
 
+import requests
 from azure.core import MatchConditions
-from azure.core.exceptions import AzureError, ResourceModifiedError, ResourceNotFoundError
-from azure.data.tables import TableClient, TableServiceClient, UpdateMode
-from azure.identity import DefaultAzureCredential
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.data.tables import TableClient, UpdateMode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from core.settings import Settings
 from stores.interfaces import AlertState, ConcurrencyError, TokenState
 
+if TYPE_CHECKING:
+    from azure.core.credentials import TokenCredential
+
+
+# How long a read or written alert state is trusted before the next webhook re-reads the row.
+_ALERT_STATE_CACHE_SECONDS = 30.0
+
+# Transaction IDs remembered in-process on top of the table, so redeliveries to this worker skip storage.
+_MAX_LOCAL_SEEN = 10_000
+
+# Token and alert state share one row; each read asks the service for only its own columns.
+_TOKEN_COLUMNS = ["access_token", "refresh_token", "expiry_ts"]
+_ALERT_COLUMNS = ["last_state_level", "alert_counter"]
+
+_credential: Optional[TokenCredential] = None
+_credential_lock = threading.Lock()
+
+# One client (and so one HTTPS connection pool) per storage account and table, shared by every store in the process.
+_table_clients: dict[tuple[Optional[str], str], TableClient] = {}
+_table_clients_lock = threading.Lock()
+
+
+def _get_credential() -> TokenCredential:
+    """Share one credential per process so its token cache survives between webhooks."""
+    global _credential
+    if _credential is None:
+        with _credential_lock:
+            if _credential is None:
+                _credential = _build_credential()
+    return _credential
+
+
+# Service-principal settings DefaultAzureCredential picks up via EnvironmentCredential/WorkloadIdentityCredential.
+_SERVICE_PRINCIPAL_ENV_VARS = ("AZURE_CLIENT_SECRET", "AZURE_CLIENT_CERTIFICATE_PATH", "AZURE_FEDERATED_TOKEN_FILE")
+
+
+def _build_credential() -> TokenCredential:
+    # azure.identity is large and only the managed-identity endpoint path needs it.
+    hosted = os.environ.get("WEBSITE_INSTANCE_ID")
+    if hosted and not any(os.environ.get(name) for name in _SERVICE_PRINCIPAL_ENV_VARS):
+        # Running on App Service/Functions with managed identity: skip DefaultAzureCredential's probe chain.
+        from azure.identity import ManagedIdentityCredential
+
+        # DefaultAzureCredential picks a user-assigned identity from AZURE_CLIENT_ID; ManagedIdentityCredential does not.
+        client_id = os.environ.get("AzureWebJobsStorage__clientId") or os.environ.get("AZURE_CLIENT_ID")
+        return ManagedIdentityCredential(client_id=client_id)
+
+    from azure.identity import DefaultAzureCredential
+
+    return DefaultAzureCredential()
+
+
+def _build_transport(pool_size: int) -> RequestsTransport:
+    """Size the SDK's connection pool for concurrent webhooks instead of requests' default of 10."""
+    session = requests.Session()
+    # Retries stay with the SDK's own retry policy, as in the transport's default adapter.
+    adapter = HTTPAdapter(
+        max_retries=Retry(total=False, redirect=False, raise_on_status=False),
+        pool_maxsize=pool_size,
+        pool_block=False,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return RequestsTransport(session=session, session_owner=True)
+
 
 class AzureTableStore:
     def __init__(self, settings: Settings):
         self.settings = settings
         self._table_client: Optional[TableClient] = None
+        # (state, etag, cached_at): lets back-to-back webhooks skip the read and write conditionally instead.
+        self._alert_cache: Optional[tuple[AlertState, Optional[str], float]] = None
+        # Transaction ID -> seen_at, oldest first; only holds IDs the table has already recorded.
+        self._seen_local: OrderedDict[str, float] = OrderedDict()
+        self._seen_local_lock = threading.Lock()
 
     def _get_table_client(self) -> TableClient:
         if self._table_client:
             return self._table_client
 
+        # Webhooks arrive on several threads; make sure only one builds the client and probes the table.
+        with _table_clients_lock:
+            if not self._table_client:
+                storage = os.environ.get("AzureWebJobsStorage__tableServiceUri") or os.environ.get("AzureWebJobsStorage")
+                key = (storage, self.settings.table_name)
+                client = _table_clients.get(key)
+                if client is None:
+                    client = _table_clients[key] = self._build_table_client()
+                self._table_client = client
+        return self._table_client
+
+    def _build_table_client(self) -> TableClient:
+        table_client: Optional[TableClient] = None
+        transport = _build_transport(self.settings.http_pool_size)
         table_endpoint = os.environ.get("AzureWebJobsStorage__tableServiceUri")
         if not table_endpoint:
             conn_str = os.environ.get("AzureWebJobsStorage")
             if conn_str:
-                service = TableServiceClient.from_connection_string(conn_str)
-                self._table_client = service.get_table_client(self.settings.table_name)
+                table_client = TableClient.from_connection_string(
+                    conn_str,
+                    table_name=self.settings.table_name,
+                    transport=transport,
+                )
         else:
-            credential = DefaultAzureCredential()
-            self._table_client = TableClient(
+            table_client = TableClient(
                 endpoint=table_endpoint,
-                credential=credential,
+                credential=_get_credential(),
                 table_name=self.settings.table_name,
+                transport=transport,
             )
 
-        if not self._table_client:
+        if not table_client:
             raise RuntimeError("Table client could not be initialized. Check storage configuration.")
 
-        try:
-            self._table_client.create_table()
-        except AzureError:
-            pass
+        # Runs once per process, when the shared client is first built.
+        if self.settings.ensure_table:
+            try:
+                table_client.create_table()
+            except ResourceExistsError:
+                pass
 
-        return self._table_client
+        return table_client
 
-    def _get_entity(self):
+    def _get_entity(self, select: list[str]) -> tuple[dict, Optional[str]]:
+        """Return the state row and its ETag, or an empty row and ``None`` if it does not exist yet."""
         table_client = self._get_table_client()
         try:
-            return table_client.get_entity(
+            entity = table_client.get_entity(
                 partition_key=self.settings.partition_key,
                 row_key=self.settings.row_key,
+                select=select,
             )
         except ResourceNotFoundError:
-            return {
-                "PartitionKey": self.settings.partition_key,
-                "RowKey": self.settings.row_key,
-            }
+            return {}, None
+        return entity, entity.metadata.get("etag")
 
     def get_token_state(self) -> TokenState:
-        entity = self._get_entity()
-        etag = entity.metadata.get("etag") if hasattr(entity, "metadata") else None
+        entity, etag = self._get_entity(_TOKEN_COLUMNS)
         return TokenState(
             access_token=entity.get("access_token"),
             refresh_token=entity.get("refresh_token"),
-            expiry_ts=float(entity.get("expiry_ts", 0) or 0),
+            expiry_ts=entity.get("expiry_ts") or 0.0,
             etag=etag,
         )
 
@@ -91,12 +184,20 @@ class AzureTableStore:
         except ResourceModifiedError as exc:
             raise ConcurrencyError("ETag mismatch during token save") from exc
 
-    def get_alert_state(self) -> AlertState:
-        entity = self._get_entity()
-        return AlertState(
-            last_state_level=int(entity.get("last_state_level", 0) or 0),
-            alert_counter=int(entity.get("alert_counter", 0) or 0),
+    def get_alert_state(self, fresh: bool = False) -> AlertState:
+        """Return the alert state, from the short-lived cache unless ``fresh`` asks for the row itself."""
+        cached = self._alert_cache
+        if not fresh and cached and time.monotonic() - cached[2] < _ALERT_STATE_CACHE_SECONDS:
+            return cached[0]
+
+        # Only this store writes these columns (always as float/int), so they come back typed; ``or`` covers absent ones.
+        entity, etag = self._get_entity(_ALERT_COLUMNS)
+        state = AlertState(
+            last_state_level=entity.get("last_state_level") or 0,
+            alert_counter=entity.get("alert_counter") or 0,
         )
+        self._alert_cache = (state, etag, time.monotonic())
+        return state
 
     def save_alert_state(self, state: AlertState) -> None:
         table_client = self._get_table_client()
@@ -106,27 +207,70 @@ class AzureTableStore:
             "last_state_level": state.last_state_level,
             "alert_counter": state.alert_counter,
         }
-        table_client.upsert_entity(payload, mode=UpdateMode.MERGE)
+        cached = self._alert_cache
+        if cached and cached[1]:
+            try:
+                metadata = table_client.update_entity(
+                    payload,
+                    mode=UpdateMode.MERGE,
+                    etag=cached[1],
+                    match_condition=MatchConditions.IfNotModified,
+                )
+            except ResourceModifiedError as exc:
+                # The state was computed from a stale read; drop it so the caller re-reads and recomputes.
+                self._alert_cache = None
+                raise ConcurrencyError("ETag mismatch during alert state save") from exc
+        else:
+            metadata = table_client.upsert_entity(payload, mode=UpdateMode.MERGE)
+
+        etag = metadata.get("etag") if isinstance(metadata, dict) else None
+        self._alert_cache = (state, etag, time.monotonic())
 
     def seen(self, key: str, ttl_seconds: int) -> bool:
-        table_client = self._get_table_client()
-        dedupe_partition = f"{self.settings.partition_key}_dedupe"
         now = time.time()
+        if self._seen_locally(key, ttl_seconds, now):
+            return True
 
+        table_client = self._get_table_client()
+        entity = {
+            "PartitionKey": f"{self.settings.partition_key}_dedupe",
+            "RowKey": key,
+            "seen_at": now,
+        }
+        # Insert-first: a new ID (the common case) costs one call, and the insert is atomic across workers.
         try:
-            existing = table_client.get_entity(partition_key=dedupe_partition, row_key=key)
-            seen_at = float(existing.get("seen_at", 0) or 0)
+            table_client.create_entity(entity)
+        except ResourceExistsError:
+            existing = table_client.get_entity(
+                partition_key=entity["PartitionKey"],
+                row_key=key,
+                select=["seen_at"],
+            )
+            seen_at = existing.get("seen_at") or 0.0
             if now - seen_at <= ttl_seconds:
+                self._remember_seen(key, seen_at)
                 return True
-        except ResourceNotFoundError:
-            pass
-
-        table_client.upsert_entity(
-            {
-                "PartitionKey": dedupe_partition,
-                "RowKey": key,
-                "seen_at": now,
-            },
-            mode=UpdateMode.MERGE,
-        )
+            # Recorded before the TTL window: treat as new and restart its clock.
+            table_client.upsert_entity(entity, mode=UpdateMode.REPLACE)
+
+        # Remembered only once the table has it, so a failed write never hides a redelivery.
+        self._remember_seen(key, now)
         return False
+
+    def _seen_locally(self, key: str, ttl_seconds: int, now: float) -> bool:
+        with self._seen_local_lock:
+            while self._seen_local:
+                oldest_key, seen_at = next(iter(self._seen_local.items()))
+                if now - seen_at <= ttl_seconds:
+                    break
+                del self._seen_local[oldest_key]
+            # Entries are only roughly ordered (a table hit keeps its original seen_at), so check this key's own age.
+            seen_at = self._seen_local.get(key)
+            return seen_at is not None and now - seen_at <= ttl_seconds
+
+    def _remember_seen(self, key: str, seen_at: float) -> None:
+        with self._seen_local_lock:
+            self._seen_local.pop(key, None)
+            self._seen_local[key] = seen_at
+            if len(self._seen_local) > _MAX_LOCAL_SEEN:
+                self._seen_local.popitem(last=False)
@@ -1,12 +1,28 @@
 from core.settings import Settings
-from stores.azure_table_store import AzureTableStore
 from stores.memory_store import MemoryStore
 
 
 def build_state_store(settings: Settings):
     backend = settings.state_backend.lower()
     if backend == "memory":
-        return MemoryStore()
-    if backend == "azure_table":
-        return AzureTableStore(settings)
-    raise ValueError(f"Unsupported STATE_BACKEND: {settings.state_backend}")
+        store = MemoryStore()
+    elif backend == "azure_table":
+        # Imported here so the memory backend never loads the Azure SDK at cold start.
+        from stores.azure_table_store import AzureTableStore
+
+        store = AzureTableStore(settings)
+    else:
+        raise ValueError(f"Unsupported STATE_BACKEND: {settings.state_backend}")
+
+    if settings.redis_url:
+        import redis
+
+        from stores.redis_store import RedisDedupeStore
+
+        client = redis.Redis.from_url(
+            settings.redis_url,
+            socket_timeout=settings.redis_timeout,
+            socket_connect_timeout=settings.redis_timeout,
+        )
+        return RedisDedupeStore(store, client)
+    return store
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from typing import Optional, Protocol
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TokenState:
     access_token: Optional[str] = None
     refresh_token: Optional[str] = None
@@ -10,7 +10,7 @@ class TokenState:
     etag: Optional[str] = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class AlertState:
     last_state_level: int = 0
     alert_counter: int = 0
@@ -29,7 +29,7 @@ class TokenStore(Protocol):
 
 
 class AlertStateStore(Protocol):
-    def get_alert_state(self) -> AlertState:
+    def get_alert_state(self, fresh: bool = False) -> AlertState:
         ...
 
     def save_alert_state(self, state: AlertState) -> None:
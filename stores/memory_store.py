@@ -1,54 +1,54 @@
 from __future__ import annotations
 
+import threading
 import time
+from collections import OrderedDict
+from dataclasses import replace
 
 from stores.interfaces import AlertState, TokenState
 
+# Upper bound on remembered transaction IDs, so a burst of unique IDs inside one TTL window cannot grow memory without limit.
+_MAX_SEEN_ENTRIES = 10_000
+
 
 class MemoryStore:
     """Simple in-memory backend for local development and tests."""
 
-    def __init__(self):
+    def __init__(self, max_seen_entries: int = _MAX_SEEN_ENTRIES):
+        self._max_seen_entries = max_seen_entries
         self._token_state = TokenState()
         self._alert_state = AlertState()
-        self._seen: dict[str, float] = {}
+        # Insertion-ordered, so the oldest entry is always at the head and expiry never scans.
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._seen_lock = threading.Lock()
 
+    # The state dataclasses are frozen, so they can be stored and handed out without copying.
     def get_token_state(self) -> TokenState:
-        return TokenState(
-            access_token=self._token_state.access_token,
-            refresh_token=self._token_state.refresh_token,
-            expiry_ts=self._token_state.expiry_ts,
-            etag=None,
-        )
+        return self._token_state
 
     def save_token_state(self, state: TokenState, etag=None) -> None:
-        self._token_state = TokenState(
-            access_token=state.access_token,
-            refresh_token=state.refresh_token,
-            expiry_ts=state.expiry_ts,
-            etag=None,
-        )
-
-    def get_alert_state(self) -> AlertState:
-        return AlertState(
-            last_state_level=self._alert_state.last_state_level,
-            alert_counter=self._alert_state.alert_counter,
-        )
+        self._token_state = replace(state, etag=None) if state.etag is not None else state
+
+    def get_alert_state(self, fresh: bool = False) -> AlertState:
+        return self._alert_state
 
     def save_alert_state(self, state: AlertState) -> None:
-        self._alert_state = AlertState(
-            last_state_level=state.last_state_level,
-            alert_counter=state.alert_counter,
-        )
+        self._alert_state = state
 
     def seen(self, key: str, ttl_seconds: int) -> bool:
-        now = time.time()
-        for k in list(self._seen.keys()):
-            if now - self._seen[k] > ttl_seconds:
-                del self._seen[k]
-
-        if key in self._seen:
-            return True
-
-        self._seen[key] = now
-        return False
+        now = time.monotonic()
+        with self._seen_lock:
+            while self._seen:
+                oldest_key, seen_at = next(iter(self._seen.items()))
+                if now - seen_at <= ttl_seconds:
+                    break
+                del self._seen[oldest_key]
+
+            if key in self._seen:
+                return True
+
+            self._seen[key] = now
+            if len(self._seen) > self._max_seen_entries:
+                # Forget the oldest ID early; at worst a very late redelivery of it is processed again.
+                self._seen.popitem(last=False)
+            return False
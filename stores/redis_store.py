@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+from stores.interfaces import AlertState, StateStore, TokenState
+
+
+logger = logging.getLogger(__name__)
+
+
+class RedisDedupeStore:
+    """Wraps another state store and keeps transaction dedupe in Redis.
+
+    The in-process and per-instance dedupe of the other backends is not shared between
+    workers; ``SET NX EX`` makes the check atomic across every process using the same Redis.
+    If Redis fails or times out, dedupe falls back to the wrapped store rather than failing the webhook.
+    """
+
+    def __init__(self, inner: StateStore, client, key_prefix: str = "mwd:seen:"):
+        self.inner = inner
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def get_token_state(self) -> TokenState:
+        return self.inner.get_token_state()
+
+    def save_token_state(self, state: TokenState, etag: Optional[str] = None) -> None:
+        self.inner.save_token_state(state, etag=etag)
+
+    def get_alert_state(self, fresh: bool = False) -> AlertState:
+        return self.inner.get_alert_state(fresh=fresh)
+
+    def save_alert_state(self, state: AlertState) -> None:
+        self.inner.save_alert_state(state)
+
+    def seen(self, key: str, ttl_seconds: int) -> bool:
+        try:
+            # SET NX returns None when the key already exists, i.e. another delivery got there first.
+            return not self.client.set(f"{self.key_prefix}{key}", b"1", nx=True, ex=ttl_seconds)
+        except Exception as exc:
+            logger.warning("event=redis_dedupe_failed error=%s", exc)
+            return self.inner.seen(key, ttl_seconds)
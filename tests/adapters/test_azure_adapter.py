@@ -1,8 +1,13 @@
+import asyncio
+import dataclasses
 import unittest
+from unittest.mock import patch
 
 import azure.functions as func
 
 import function_app
+from core.webhook_service import WebhookService
+from stores.memory_store import MemoryStore
 
 
 class AzureAdapterTests(unittest.TestCase):
@@ -27,6 +32,24 @@ class AzureAdapterTests(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_body(), b'{"status":"ok"}')
 
+    def test_webhook_entrypoint_rejects_invalid_json(self):
+        req = func.HttpRequest(
+            method="POST",
+            url="http://localhost/api/monzo_webhook",
+            headers={"X-Correlation-ID": "cid-1", "X-Webhook-Secret": "webhook_secret"},
+            params={},
+            route_params={},
+            body=b'{"type":"transaction.created",',
+        )
+        settings = dataclasses.replace(function_app.settings, webhook_secret="webhook_secret")
+        service = WebhookService(settings, function_app.monzo_client, MemoryStore())
+
+        with patch.object(function_app, "service", service):
+            response = asyncio.run(function_app.monzo_webhook(req))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.headers["X-Correlation-ID"], "cid-1")
+
 
 if __name__ == "__main__":
     unittest.main()
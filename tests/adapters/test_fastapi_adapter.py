@@ -1,8 +1,44 @@
+import dataclasses
 import unittest
+from unittest.mock import patch
 
 import app_fastapi
 import asyncio
 
+from core.webhook_service import WebhookService
+from stores.memory_store import MemoryStore
+
+
+def _post_webhook(body: bytes, headers: dict[str, str] | None = None, query_string: bytes = b""):
+    raw_headers = [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()]
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/monzo_webhook",
+        "raw_path": b"/monzo_webhook",
+        "root_path": "",
+        "headers": raw_headers,
+        "query_string": query_string,
+        "server": ("testserver", 80),
+        "client": ("testclient", 50000),
+    }
+    asyncio.run(app_fastapi.app(scope, receive, send))
+
+    start = next(m for m in messages if m["type"] == "http.response.start")
+    response_body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return start["status"], dict(start["headers"]), response_body
+
 
 class FastAPIAdapterTests(unittest.TestCase):
     def test_fastapi_app_exposes_webhook_route(self):
@@ -18,6 +54,47 @@ class FastAPIAdapterTests(unittest.TestCase):
 
         self.assertEqual(payload, {"status": "ok"})
 
+    def test_fastapi_webhook_rejects_invalid_json(self):
+        settings = dataclasses.replace(app_fastapi.settings, webhook_secret="webhook_secret")
+        service = WebhookService(settings, app_fastapi.monzo_client, MemoryStore())
+
+        with patch.object(app_fastapi, "service", service):
+            status, headers, body = _post_webhook(
+                b'{"type":"transaction.created",',
+                headers={"X-Correlation-ID": "cid-1", "X-Webhook-Secret": "webhook_secret"},
+            )
+
+        self.assertEqual(status, 400)
+        self.assertEqual(body, b"Invalid JSON")
+        self.assertEqual(headers[b"x-correlation-id"], b"cid-1")
+
+    def test_fastapi_webhook_rejects_missing_secret(self):
+        status, _, body = _post_webhook(b'{"type":"transaction.created","data":{}}')
+
+        self.assertEqual(status, 401)
+        self.assertEqual(body, b"Unauthorized")
+
+    def test_fastapi_webhook_rejects_oversized_body(self):
+        oversized = b" " * (app_fastapi.settings.max_body_bytes + 1)
+
+        status, _, body = _post_webhook(oversized)
+
+        self.assertEqual(status, 413)
+        self.assertEqual(body, b"Payload too large")
+
+    def test_fastapi_webhook_rejects_oversized_declared_length(self):
+        status, _, _ = _post_webhook(b"{}", headers={"Content-Length": str(app_fastapi.settings.max_body_bytes + 1)})
+
+        self.assertEqual(status, 413)
+
+    def test_fastapi_webhook_correlation_id_not_leaked_into_cached_response(self):
+        _post_webhook(b"{}", headers={"X-Correlation-ID": "cid-1"})
+        status, headers, _ = _post_webhook(b"{}", headers={"X-Correlation-ID": "cid-2"})
+
+        self.assertEqual(status, 401)
+        self.assertEqual(headers[b"x-correlation-id"], b"cid-2")
+        self.assertNotIn((b"x-correlation-id", b"cid-1"), app_fastapi._RESPONSES[(401, b"Unauthorized")].raw_headers)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,214 @@
+import dataclasses
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+from azure.data.tables import TableEntity
+
+from core.settings import Settings
+from stores import azure_table_store
+from stores.azure_table_store import AzureTableStore, _build_credential
+from stores.interfaces import AlertState, ConcurrencyError
+
+
+def _settings() -> Settings:
+    return Settings(
+        monzo_client_id="id",
+        monzo_client_secret="secret",
+        monzo_account_id="acc_test",
+        monzo_refresh_token="seed_refresh",
+        webhook_secret="webhook_secret",
+        state_backend="azure_table",
+        balance_limit_warning=25000,
+        balance_limit_critical=10000,
+        alert_frequency=10,
+        request_timeout=(3.05, 10),
+        token_cache_ttl=3000,
+        table_name="monzotokens",
+        partition_key="monzo",
+        row_key="bot",
+        seen_ttl=600,
+    )
+
+
+class AzureTableStoreClientTests(unittest.TestCase):
+    def setUp(self):
+        azure_table_store._table_clients.clear()
+
+    def tearDown(self):
+        azure_table_store._table_clients.clear()
+
+    def test_concurrent_first_use_builds_one_client(self):
+        store = AzureTableStore(_settings())
+        built = []
+
+        def slow_build():
+            built.append(object())
+            time.sleep(0.05)
+            return built[-1]
+
+        with patch.object(store, "_build_table_client", side_effect=slow_build):
+            threads = [threading.Thread(target=store._get_table_client) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(built), 1)
+        self.assertIs(store._get_table_client(), built[0])
+
+    @patch.dict("os.environ", {"AzureWebJobsStorage": "UseDevelopmentStorage=true"}, clear=True)
+    @patch("stores.azure_table_store.TableClient")
+    def test_existing_table_is_not_an_error(self, table_client_cls):
+        table_client = MagicMock()
+        table_client.create_table.side_effect = ResourceExistsError("exists")
+        table_client_cls.from_connection_string.return_value = table_client
+
+        store = AzureTableStore(_settings())
+
+        self.assertIs(store._get_table_client(), table_client)
+        self.assertIs(store._get_table_client(), table_client)
+        table_client.create_table.assert_called_once()
+        transport = table_client_cls.from_connection_string.call_args.kwargs["transport"]
+        self.assertEqual(transport.session.get_adapter("https://x").poolmanager.connection_pool_kw["maxsize"], 50)
+
+    @patch.dict("os.environ", {"AzureWebJobsStorage": "UseDevelopmentStorage=true"}, clear=True)
+    @patch("stores.azure_table_store.TableClient")
+    def test_table_creation_can_be_skipped(self, table_client_cls):
+        table_client = table_client_cls.from_connection_string.return_value
+
+        store = AzureTableStore(dataclasses.replace(_settings(), ensure_table=False))
+
+        self.assertIs(store._get_table_client(), table_client)
+        table_client.create_table.assert_not_called()
+
+    @patch.dict("os.environ", {"AzureWebJobsStorage": "UseDevelopmentStorage=true"}, clear=True)
+    def test_stores_share_one_client_per_table(self):
+        first, second = AzureTableStore(_settings()), AzureTableStore(_settings())
+
+        with patch.object(AzureTableStore, "_build_table_client", side_effect=lambda: object()) as build:
+            self.assertIs(first._get_table_client(), second._get_table_client())
+
+        build.assert_called_once()
+
+
+class AzureTableStoreSeenTests(unittest.TestCase):
+    def setUp(self):
+        self.store = AzureTableStore(_settings())
+        self.table_client = MagicMock()
+        self.store._table_client = self.table_client
+
+    def test_new_id_costs_a_single_insert(self):
+        self.assertFalse(self.store.seen("tx_1", 600))
+
+        self.table_client.create_entity.assert_called_once()
+        self.table_client.get_entity.assert_not_called()
+
+    def test_redelivery_is_answered_from_local_cache(self):
+        self.assertFalse(self.store.seen("tx_1", 600))
+        self.assertTrue(self.store.seen("tx_1", 600))
+
+        self.table_client.create_entity.assert_called_once()
+
+    def test_id_recorded_by_another_worker_is_seen(self):
+        self.table_client.create_entity.side_effect = ResourceExistsError("exists")
+        self.table_client.get_entity.return_value = {"seen_at": time.time() - 10}
+
+        self.assertTrue(self.store.seen("tx_1", 600))
+        self.table_client.upsert_entity.assert_not_called()
+
+    def test_expired_record_is_claimed_again(self):
+        self.table_client.create_entity.side_effect = ResourceExistsError("exists")
+        self.table_client.get_entity.return_value = {"seen_at": time.time() - 3600}
+
+        self.assertFalse(self.store.seen("tx_1", 600))
+        self.table_client.upsert_entity.assert_called_once()
+
+    def test_failed_write_is_not_remembered(self):
+        self.table_client.create_entity.side_effect = RuntimeError("storage down")
+        with self.assertRaises(RuntimeError):
+            self.store.seen("tx_1", 600)
+
+        self.table_client.create_entity.side_effect = None
+        self.assertFalse(self.store.seen("tx_1", 600))
+
+
+class CredentialTests(unittest.TestCase):
+    @patch.dict("os.environ", {"WEBSITE_INSTANCE_ID": "abc", "AzureWebJobsStorage__clientId": "uami"}, clear=True)
+    @patch("azure.identity.DefaultAzureCredential")
+    @patch("azure.identity.ManagedIdentityCredential")
+    def test_managed_identity_used_when_hosted(self, managed_cls, default_cls):
+        self.assertIs(_build_credential(), managed_cls.return_value)
+        managed_cls.assert_called_once_with(client_id="uami")
+        default_cls.assert_not_called()
+
+    @patch.dict("os.environ", {"WEBSITE_INSTANCE_ID": "abc", "AZURE_CLIENT_ID": "uami_env"}, clear=True)
+    @patch("azure.identity.ManagedIdentityCredential")
+    def test_user_assigned_identity_from_azure_client_id(self, managed_cls):
+        self.assertIs(_build_credential(), managed_cls.return_value)
+        managed_cls.assert_called_once_with(client_id="uami_env")
+
+    @patch.dict(
+        "os.environ",
+        {"WEBSITE_INSTANCE_ID": "abc", "AZURE_CLIENT_ID": "app", "AZURE_TENANT_ID": "tenant", "AZURE_CLIENT_SECRET": "s"},
+        clear=True,
+    )
+    @patch("azure.identity.DefaultAzureCredential")
+    @patch("azure.identity.ManagedIdentityCredential")
+    def test_service_principal_env_uses_default_credential_when_hosted(self, managed_cls, default_cls):
+        self.assertIs(_build_credential(), default_cls.return_value)
+        managed_cls.assert_not_called()
+
+    @patch.dict("os.environ", {}, clear=True)
+    @patch("azure.identity.DefaultAzureCredential")
+    def test_default_credential_used_locally(self, default_cls):
+        self.assertIs(_build_credential(), default_cls.return_value)
+
+
+class AzureTableStoreAlertStateTests(unittest.TestCase):
+    def setUp(self):
+        self.store = AzureTableStore(_settings())
+        self.table_client = MagicMock()
+        self.store._table_client = self.table_client
+        entity = TableEntity(last_state_level=1, alert_counter=3)
+        entity._metadata = {"etag": "etag_1"}
+        self.table_client.get_entity.return_value = entity
+        self.table_client.update_entity.return_value = {"etag": "etag_2"}
+
+    def test_recent_state_is_served_without_a_read(self):
+        self.assertEqual(self.store.get_alert_state(), AlertState(1, 3))
+        self.assertEqual(self.store.get_alert_state(), AlertState(1, 3))
+
+        self.table_client.get_entity.assert_called_once()
+        self.assertEqual(self.table_client.get_entity.call_args.kwargs["select"], ["last_state_level", "alert_counter"])
+
+    def test_fresh_read_bypasses_cache(self):
+        self.store.get_alert_state()
+        self.store.get_alert_state(fresh=True)
+
+        self.assertEqual(self.table_client.get_entity.call_count, 2)
+
+    def test_save_is_conditional_on_cached_etag_and_refreshes_cache(self):
+        self.store.get_alert_state()
+        self.store.save_alert_state(AlertState(2, 0))
+
+        self.assertEqual(self.table_client.update_entity.call_args.kwargs["etag"], "etag_1")
+        self.table_client.upsert_entity.assert_not_called()
+        self.assertEqual(self.store.get_alert_state(), AlertState(2, 0))
+        self.table_client.get_entity.assert_called_once()
+
+    def test_save_conflict_clears_cache_so_next_read_is_fresh(self):
+        self.table_client.update_entity.side_effect = ResourceModifiedError("changed")
+
+        self.store.get_alert_state()
+        with self.assertRaises(ConcurrencyError):
+            self.store.save_alert_state(AlertState(2, 0))
+
+        self.table_client.upsert_entity.assert_not_called()
+        self.store.get_alert_state()
+        self.assertEqual(self.table_client.get_entity.call_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from unittest.mock import patch
+
+from stores.memory_store import MemoryStore
+
+
+class MemoryStoreSeenTests(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryStore()
+
+    def test_seen_reports_repeat_within_ttl(self):
+        self.assertFalse(self.store.seen("tx_1", 600))
+        self.assertTrue(self.store.seen("tx_1", 600))
+
+    @patch("stores.memory_store.time.monotonic")
+    def test_seen_expires_entries_after_ttl(self, monotonic):
+        monotonic.return_value = 1000.0
+        self.assertFalse(self.store.seen("tx_1", 600))
+        self.assertFalse(self.store.seen("tx_2", 600))
+
+        monotonic.return_value = 1601.0
+        self.assertFalse(self.store.seen("tx_1", 600))
+        self.assertNotIn("tx_2", self.store._seen)
+
+    def test_seen_evicts_oldest_beyond_capacity(self):
+        store = MemoryStore(max_seen_entries=2)
+        for key in ("tx_1", "tx_2", "tx_3"):
+            self.assertFalse(store.seen(key, 600))
+
+        self.assertEqual(list(store._seen), ["tx_2", "tx_3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import socket
+import unittest
+
+import requests
+from urllib3 import HTTPResponse
+
+from core.monzo_client import MonzoClient, build_session
+
+
+class _RecordingSession:
+    def __init__(self):
+        self.calls = []
+
+    def _record(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+
+    def get(self, url, **kwargs):
+        self._record("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        self._record("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        self._record("PATCH", url, **kwargs)
+
+
+class MonzoClientTests(unittest.TestCase):
+    def setUp(self):
+        self.session = _RecordingSession()
+        self.client = MonzoClient(self.session, (3.05, 10))
+
+    def test_post_feed_sends_full_feed_item(self):
+        self.client.post_feed("tok", "acc_1", "monzo://transactions/tx_1", "Title", "Body", "#E74C3C")
+
+        method, url, kwargs = self.session.calls[0]
+        self.assertEqual((method, url), ("POST", "https://api.monzo.com/feed"))
+        self.assertEqual(kwargs["headers"], {"Authorization": "Bearer tok"})
+        self.assertEqual(
+            kwargs["data"],
+            {
+                "account_id": "acc_1",
+                "type": "basic",
+                "url": "monzo://transactions/tx_1",
+                "params[title]": "Title",
+                "params[body]": "Body",
+                "params[image_url]": "https://cdn-icons-png.flaticon.com/512/564/564619.png",
+                "params[background_color]": "#E74C3C",
+                "params[title_color]": "#333333",
+            },
+        )
+
+    def test_warm_up_ignores_connection_errors(self):
+        def fail(url, **kwargs):
+            raise requests.ConnectionError("offline")
+
+        self.session.get = fail
+        self.client.warm_up()
+
+    def test_auth_headers_follow_token_changes(self):
+        self.client.get_balance("tok_1", "acc_1")
+        self.client.get_transaction("tok_1", "tx_1")
+        self.client.get_balance("tok_2", "acc_1")
+
+        headers = [kwargs["headers"] for _, _, kwargs in self.session.calls]
+        self.assertIs(headers[0], headers[1])
+        self.assertEqual(headers[2], {"Authorization": "Bearer tok_2"})
+
+
+class BuildSessionTests(unittest.TestCase):
+    def test_pooled_sockets_use_nodelay_and_keepalive(self):
+        adapter = build_session().get_adapter("https://api.monzo.com")
+
+        options = adapter.poolmanager.connection_pool_kw["socket_options"]
+        self.assertIn((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), options)
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), options)
+
+    def test_only_reads_are_retried(self):
+        retries = build_session().get_adapter("https://api.monzo.com").max_retries
+
+        self.assertTrue(retries.is_retry("GET", 503))
+        self.assertFalse(retries.is_retry("POST", 503))
+        self.assertFalse(retries.is_retry("PATCH", 503))
+
+    def test_rate_limited_reads_retried_after_capped_retry_after(self):
+        retries = build_session().get_adapter("https://api.monzo.com").max_retries
+
+        self.assertTrue(retries.is_retry("GET", 429, has_retry_after=True))
+        self.assertFalse(retries.is_retry("POST", 429, has_retry_after=True))
+        throttled = HTTPResponse(status=429, headers={"Retry-After": "120"})
+        self.assertEqual(retries.new(total=1).get_retry_after(throttled), 2.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from stores.memory_store import MemoryStore
+from stores.redis_store import RedisDedupeStore
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+
+    def set(self, name, value, nx=False, ex=None):
+        if nx and name in self.values:
+            return None
+        self.values[name] = value
+        self.expiries[name] = ex
+        return True
+
+
+class RedisDedupeStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.redis = _FakeRedis()
+        self.store = RedisDedupeStore(MemoryStore(), self.redis)
+
+    def test_seen_uses_set_nx_with_ttl(self):
+        self.assertFalse(self.store.seen("tx_1", 600))
+        self.assertTrue(self.store.seen("tx_1", 600))
+        self.assertEqual(self.redis.expiries["mwd:seen:tx_1"], 600)
+
+    def test_redis_failure_falls_back_to_inner_store(self):
+        def unavailable(*args, **kwargs):
+            raise TimeoutError("redis timed out")
+
+        self.redis.set = unavailable
+        self.assertFalse(self.store.seen("tx_2", 600))
+        self.assertTrue(self.store.seen("tx_2", 600))
+
+    def test_state_calls_delegate_to_inner_store(self):
+        self.assertEqual(self.store.get_alert_state(), self.store.inner.get_alert_state())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,18 @@
 import os
 import unittest
+from dataclasses import replace
 from unittest.mock import patch
 
-from core.settings import load_settings
+from core.settings import load_settings, missing_required_settings
 
 
 class SettingsTests(unittest.TestCase):
+    def setUp(self):
+        load_settings.cache_clear()
+
+    def tearDown(self):
+        load_settings.cache_clear()
+
     @patch.dict(os.environ, {}, clear=True)
     def test_allow_query_secret_defaults_true(self):
         settings = load_settings()
@@ -16,6 +23,36 @@ class SettingsTests(unittest.TestCase):
         settings = load_settings()
         self.assertFalse(settings.allow_query_secret)
 
+    @patch.dict(os.environ, {"WEBHOOK_SECRET": "s3cret"}, clear=True)
+    def test_webhook_secret_bytes_derived_once(self):
+        settings = load_settings()
+        self.assertEqual(settings.webhook_secret_bytes, b"s3cret")
+        self.assertIsNone(replace(settings, webhook_secret=None).webhook_secret_bytes)
+
+    @patch.dict(os.environ, {"VERIFY_TRANSACTIONS": "false"}, clear=True)
+    def test_verify_transactions_can_be_disabled(self):
+        settings = load_settings()
+        self.assertFalse(settings.verify_transactions)
+
+    @patch.dict(os.environ, {"WORKER_THREADS": "16"}, clear=True)
+    def test_worker_threads_read_from_env(self):
+        settings = load_settings()
+        self.assertEqual(settings.worker_threads, 16)
+
+    @patch.dict(os.environ, {"REDIS_TIMEOUT": "0.25"}, clear=True)
+    def test_redis_timeout_read_from_env(self):
+        settings = load_settings()
+        self.assertEqual(settings.redis_timeout, 0.25)
+
+    @patch.dict(os.environ, {}, clear=True)
+    def test_load_settings_is_memoized(self):
+        self.assertIs(load_settings(), load_settings())
+
+    @patch.dict(os.environ, {"MONZO_CLIENT_ID": "id", "MONZOACCOUNTID": "acc"}, clear=True)
+    def test_missing_required_settings_lists_unset_vars(self):
+        settings = load_settings()
+        self.assertEqual(missing_required_settings(settings), ["MONZOCLIENTSECRET", "WEBHOOKSECRET"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,22 +1,59 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
 import unittest
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+from unittest.mock import patch
+
+import orjson
 
 from core.settings import Settings
-from core.webhook_service import WebhookService
+from core.webhook_service import WebhookService, fast_probe_type
+from stores.interfaces import AlertState, ConcurrencyError, TokenState
 from stores.memory_store import MemoryStore
 
 
+@dataclass(frozen=True, slots=True)
 class _FakeResponse:
-    def __init__(self, status_code=200, json_data=None, text=""):
-        self.status_code = status_code
-        self._json_data = json_data or {}
-        self.text = text
+    status_code: int = 200
+    json_data: dict = field(default_factory=dict)
+    text: str = ""
+    # Serialized once, the way the service reads real responses.
+    content: bytes = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "content", orjson.dumps(self.json_data))
 
     def raise_for_status(self):
         if self.status_code >= 400:
             raise RuntimeError(f"http {self.status_code}")
 
     def json(self):
-        return self._json_data
+        return self.json_data
+
+
+# Responses are never mutated, so each fake endpoint hands back the same instance.
+_REFRESH_RESPONSE = _FakeResponse(
+    200,
+    {
+        "access_token": "access_1",
+        "refresh_token": "refresh_2",
+        "expires_in": 3600,
+    },
+)
+_TRANSACTION_RESPONSE = _FakeResponse(200, {"transaction": {"account_id": "acc_test"}})
+
+
+_SEEDED_TOKEN = TokenState(access_token="access_1", refresh_token="refresh_2", expiry_ts=time.time() + 3000)
+
+_AUTH_HEADERS = {"x-webhook-secret": "webhook_secret"}
+
+
+def _tx_payload(tx_id, **data):
+    return {"type": "transaction.created", "data": {"id": tx_id, "account_id": "acc_test", **data}}
 
 
 class _FakeMonzoClient:
@@ -27,36 +64,42 @@ class _FakeMonzoClient:
         self.note_call_count = 0
         self.last_feed_url = None
         self.balance = 5000
+        self.warm_up_count = 0
+        self.refresh_count = 0
+        self._balance_responses = {}
+
+    def warm_up(self):
+        self.warm_up_count += 1
 
     def refresh_token(self, client_id, client_secret, refresh_token):
-        return _FakeResponse(
-            200,
-            {
-                "access_token": "access_1",
-                "refresh_token": "refresh_2",
-                "expires_in": 3600,
-            },
-        )
+        self.refresh_count += 1
+        return _REFRESH_RESPONSE
 
     def get_balance(self, access_token, account_id):
-        return _FakeResponse(200, {"balance": self.balance})
+        # Keyed by value, so tests can still change self.balance between webhooks.
+        response = self._balance_responses.get(self.balance)
+        if response is None:
+            response = self._balance_responses[self.balance] = _FakeResponse(200, {"balance": self.balance})
+        return response
 
     def get_transaction(self, access_token, tx_id):
-        return _FakeResponse(200, {"transaction": {"account_id": "acc_test"}})
+        return _TRANSACTION_RESPONSE
 
     def post_feed(self, access_token, account_id, click_url, title, body, color):
         self.feed_called = True
         self.feed_call_count += 1
         self.last_feed_url = click_url
 
-    def patch_transaction_note(self, *args, **kwargs):
+    def patch_transaction_note(self, access_token, tx_id, note):
         self.note_called = True
         self.note_call_count += 1
 
 
 class WebhookServiceTests(unittest.TestCase):
-    def setUp(self):
-        self.settings = Settings(
+    @classmethod
+    def setUpClass(cls):
+        # Settings is frozen, so one instance can be shared by every test.
+        cls.settings = Settings(
             monzo_client_id="id",
             monzo_client_secret="secret",
             monzo_account_id="acc_test",
@@ -74,24 +117,46 @@ class WebhookServiceTests(unittest.TestCase):
             row_key="bot",
             seen_ttl=600,
         )
-        self.store = MemoryStore()
-        self.monzo = _FakeMonzoClient()
-        self.service = WebhookService(self.settings, self.monzo, self.store)
+
+    # unittest makes a fresh TestCase per test, so these are per-test and only built when a test uses them.
+    @cached_property
+    def store(self):
+        # Seeded with a live token so tests that are not about refreshing skip the refresh call.
+        store = MemoryStore()
+        store.save_token_state(_SEEDED_TOKEN)
+        return store
+
+    @cached_property
+    def monzo(self):
+        return _FakeMonzoClient()
+
+    @cached_property
+    def service(self):
+        return WebhookService(self.settings, self.monzo, self.store)
 
     def test_rejects_invalid_secret(self):
         res = self.service.handle_webhook({}, {}, {"type": "transaction.created", "data": {}})
         self.assertEqual(res.status_code, 401)
 
+    def test_rejects_non_ascii_secret(self):
+        res = self.service.handle_webhook({"x-webhook-secret": "wébhook"}, {}, {"type": "transaction.created", "data": {}})
+        self.assertEqual(res.status_code, 401)
+
+    def test_secret_compared_in_constant_time_as_bytes(self):
+        with patch("core.webhook_service.secrets.compare_digest", wraps=secrets.compare_digest) as compare_digest:
+            res = self.service.handle_webhook({"x-webhook-secret": "wrong"}, {}, _tx_payload("tx_ct"))
+        self.assertEqual(res.status_code, 401)
+        compare_digest.assert_called_once_with(b"wrong", b"webhook_secret")
 
     def test_query_secret_rejected_when_disabled(self):
-        payload = {"type": "transaction.created", "data": {"id": "tx_q1", "account_id": "acc_test"}}
+        payload = _tx_payload("tx_q1")
         res = self.service.handle_webhook({}, {"secret_key": "webhook_secret"}, payload)
         self.assertEqual(res.status_code, 401)
 
     def test_query_secret_accepted_when_enabled(self):
-        secure_settings = self.settings.__class__(**{**self.settings.__dict__, "allow_query_secret": True})
+        secure_settings = replace(self.settings, allow_query_secret=True)
         service = WebhookService(secure_settings, self.monzo, MemoryStore())
-        payload = {"type": "transaction.created", "data": {"id": "tx_q2", "account_id": "acc_test"}}
+        payload = _tx_payload("tx_q2")
         res = service.handle_webhook({}, {"secret_key": "webhook_secret"}, payload)
         self.assertEqual(res.status_code, 200)
 
@@ -117,73 +182,236 @@ class WebhookServiceTests(unittest.TestCase):
         self.assertTrue(legacy.allow_query_secret)
 
     def test_duplicate_transaction_is_ignored(self):
-        payload = {"type": "transaction.created", "data": {"id": "tx_1", "account_id": "acc_test"}}
-        headers = {"x-webhook-secret": "webhook_secret"}
-        first = self.service.handle_webhook(headers, {}, payload)
-        second = self.service.handle_webhook(headers, {}, payload)
+        payload = _tx_payload("tx_1")
+        first = self.service.handle_webhook(_AUTH_HEADERS, {}, payload)
+        second = self.service.handle_webhook(_AUTH_HEADERS, {}, payload)
         self.assertEqual(first.status_code, 200)
-        self.assertEqual(second.body, "Duplicate")
+        self.assertEqual(second.body, b"Duplicate")
+
+    def test_fast_probe_type(self):
+        self.assertEqual(fast_probe_type(b'{"type": "transaction.created", "data": {}}'), "transaction.created")
+        self.assertIsNone(fast_probe_type(b'{"type": "transaction.updated", "data": {}}'))
+
+    def test_raw_webhook_authenticates_before_parsing(self):
+        res = self.service.handle_raw_webhook({}, {}, b"{not json")
+        self.assertEqual(res.status_code, 401)
+
+    def test_raw_webhook_accepts_valid_signature(self):
+        raw = b'{"type": "transaction.created", "data": {"id": "tx_sig", "account_id": "acc_test"}}'
+        signature = hmac.new(b"webhook_secret", raw, hashlib.sha256).hexdigest()
+        res = self.service.handle_raw_webhook({"x-webhook-signature": signature}, {}, raw)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(self.monzo.feed_called)
+
+    def test_raw_webhook_rejects_bad_signature(self):
+        raw = b'{"type": "transaction.created", "data": {"id": "tx_sig", "account_id": "acc_test"}}'
+        headers = {"x-webhook-signature": "00" * 32, "x-webhook-secret": "webhook_secret"}
+        res = self.service.handle_raw_webhook(headers, {}, raw)
+        self.assertEqual(res.status_code, 401)
+
+    def test_raw_webhook_skips_parse_for_other_event_types(self):
+        res = self.service.handle_raw_webhook(_AUTH_HEADERS, {}, b'{"type": "transaction.updated", not json')
+        self.assertEqual((res.status_code, res.body), (200, b"Received"))
+        self.assertFalse(self.monzo.feed_called)
+
+    def test_raw_webhook_rejects_invalid_json(self):
+        res = self.service.handle_raw_webhook(_AUTH_HEADERS, {}, b'{"type": "transaction.created", ')
+        self.assertEqual((res.status_code, res.body), (400, b"Invalid JSON"))
+
+    def test_raw_webhook_processes_transaction(self):
+        raw = b'{"type": "transaction.created", "data": {"id": "tx_raw", "account_id": "acc_test"}}'
+        res = self.service.handle_raw_webhook(_AUTH_HEADERS, {}, raw)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(self.monzo.feed_called)
+
+    def test_access_token_cached_in_process(self):
+        first = self.service.get_monzo_access_token()
+        with patch.object(self.store, "get_token_state", side_effect=AssertionError("store read")):
+            second = self.service.get_monzo_access_token()
+        self.assertEqual(first, "access_1")
+        self.assertEqual(second, "access_1")
+
+    def test_concurrent_token_requests_refresh_once(self):
+        self.store = MemoryStore()
+        refresh_calls = []
+        original_refresh = self.monzo.refresh_token
+
+        def slow_refresh(*args):
+            refresh_calls.append(args)
+            time.sleep(0.05)
+            return original_refresh(*args)
+
+        self.monzo.refresh_token = slow_refresh
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(self.service.get_monzo_access_token())) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(refresh_calls), 1)
+        self.assertEqual(tokens, ["access_1"] * 5)
+
+    def test_irrelevant_transactions_skip_token_fetch(self):
+        with patch.object(self.service, "get_monzo_access_token", side_effect=AssertionError("token fetched")):
+            other_account = self.service.handle_webhook(_AUTH_HEADERS, {}, {"type": "transaction.created", "data": {"id": "tx_o", "account_id": "acc_other"}})
+            missing_id = self.service.handle_webhook(_AUTH_HEADERS, {}, {"type": "transaction.created", "data": {"account_id": "acc_test"}})
+        self.assertEqual(other_account.body, b"Received")
+        self.assertEqual(missing_id.body, b"Received")
+
+    def test_declines_skip_token_fetch(self):
+        payload = _tx_payload("tx_dec", amount=-500, decline_reason="INSUFFICIENT_FUNDS")
+        with patch.object(self.service, "get_monzo_access_token", side_effect=AssertionError("token fetched")):
+            result = self.service.handle_webhook(_AUTH_HEADERS, {}, payload)
+        self.assertEqual(result.body, b"Received")
+
+    def test_credit_never_alerts(self):
+        self.monzo.balance = 5000
+        self.service.handle_webhook(_AUTH_HEADERS, {}, _tx_payload("tx_cr", amount=1000))
+        self.assertFalse(self.monzo.feed_called)
+
+    def test_spend_after_recovering_credit_alerts_again(self):
+        self.monzo.balance = 5000
+        self.service.handle_webhook(_AUTH_HEADERS, {}, _tx_payload("tx_crit", amount=-500))
+        self.monzo.balance = 50000
+        self.service.handle_webhook(_AUTH_HEADERS, {}, _tx_payload("tx_topup", amount=45000))
+        self.monzo.balance = 5000
+        self.service.handle_webhook(_AUTH_HEADERS, {}, _tx_payload("tx_spend", amount=-45000))
+
+        self.assertEqual(self.monzo.feed_call_count, 2)
+
+    def test_failed_verification_skips_alert(self):
+        self.monzo.get_transaction = lambda access_token, tx_id: _FakeResponse(200, {"transaction": {"account_id": "acc_other"}})
+        payload = _tx_payload("tx_v1")
+        result = self.service.handle_webhook(_AUTH_HEADERS, {}, payload)
+        self.assertEqual(result.status_code, 200)
+        self.assertFalse(self.monzo.feed_called)
+
+    def test_verification_can_be_disabled(self):
+        settings = replace(self.settings, verify_transactions=False)
+        service = WebhookService(settings, self.monzo, MemoryStore())
+        self.monzo.get_transaction = lambda access_token, tx_id: self.fail("unexpected transaction request")
+        payload = _tx_payload("tx_v2")
+        result = service.handle_webhook(_AUTH_HEADERS, {}, payload)
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(self.monzo.feed_called)
+
+    def test_warm_up_only_when_configured(self):
+        unconfigured = WebhookService(replace(self.settings, webhook_secret=None), self.monzo, MemoryStore())
+        unconfigured.start_warm_up()
+        self.service.start_warm_up()
+        unconfigured._executor.shutdown(wait=True)
+        self.service._executor.shutdown(wait=True)
+        self.assertEqual(self.monzo.warm_up_count, 1)
+
+    def test_warm_up_rate_limited_by_min_interval(self):
+        self.service.start_warm_up(min_interval=60)
+        self.service.start_warm_up(min_interval=60)
+        self.service._executor.shutdown(wait=True)
+        self.assertEqual(self.monzo.warm_up_count, 1)
+
+    def test_unchanged_alert_state_is_not_written(self):
+        self.monzo.balance = 50000
+        payload = _tx_payload("tx_s1")
+        with patch.object(self.store, "save_alert_state") as save_alert_state:
+            result = self.service.handle_webhook(_AUTH_HEADERS, {}, payload)
+        self.assertEqual(result.body, b"Received")
+        save_alert_state.assert_not_called()
+
+    def test_alert_state_conflict_rereads_and_recomputes(self):
+        self.store.save_alert_state(AlertState(last_state_level=2, alert_counter=1))
+        original_save = self.store.save_alert_state
+        saved = []
+
+        def save_after_concurrent_write(state):
+            if not saved:
+                # Another instance bumps the counter between this webhook's read and write.
+                original_save(AlertState(last_state_level=2, alert_counter=2))
+                saved.append(None)
+                raise ConcurrencyError("changed")
+            original_save(state)
+
+        with patch.object(self.store, "save_alert_state", side_effect=save_after_concurrent_write):
+            self.service.handle_webhook(_AUTH_HEADERS, {}, _tx_payload("tx_r1"))
+        self.assertEqual(self.store.get_alert_state(), AlertState(last_state_level=2, alert_counter=3))
+
+    def test_unchanged_cached_alert_state_is_confirmed_before_skipping_write(self):
+        # Another instance escalated the row after this one cached level 0.
+        self.store.save_alert_state(AlertState(last_state_level=2, alert_counter=0))
+        self.monzo.balance = 50000
+        stale = AlertState()
+
+        with patch.object(self.store, "get_alert_state", side_effect=lambda fresh=False: self.store._alert_state if fresh else stale):
+            self.service.handle_webhook(_AUTH_HEADERS, {}, _tx_payload("tx_st"))
+        self.assertEqual(self.store.get_alert_state(), AlertState(last_state_level=0, alert_counter=0))
+
+    def test_alert_dropped_when_state_conflicts_persist(self):
+        with patch.object(self.store, "save_alert_state", side_effect=ConcurrencyError("changed")):
+            result = self.service.handle_webhook(_AUTH_HEADERS, {}, _tx_payload("tx_cf"))
+        self.assertEqual(result.body, b"Received")
+        self.assertFalse(self.monzo.feed_called)
 
     def test_build_transaction_click_url(self):
         self.assertEqual(self.service.build_transaction_click_url("tx_abc"), "monzo://transactions/tx_abc")
         self.assertEqual(self.service.build_transaction_click_url(None), "monzo://home")
 
     def test_alert_path_posts_feed_and_note(self):
-        payload = {
-            "type": "transaction.created",
-            "data": {
-                "id": "tx_123",
-                "account_id": "acc_test",
-                "description": "Coffee",
-            },
-        }
-        headers = {"x-webhook-secret": "webhook_secret"}
-        result = self.service.handle_webhook(headers, {}, payload)
+        payload = _tx_payload("tx_123", description="Coffee")
+        result = self.service.handle_webhook(_AUTH_HEADERS, {}, payload)
         self.assertEqual(result.status_code, 200)
         self.assertTrue(self.monzo.feed_called)
         self.assertTrue(self.monzo.note_called)
         self.assertEqual(self.monzo.last_feed_url, "monzo://transactions/tx_123")
 
+    def test_balance_read_from_api_not_payload(self):
+        self.monzo.balance = 50000
+        payload = _tx_payload("tx_b1", account_balance=0)
+        result = self.service.handle_webhook(_AUTH_HEADERS, {}, payload)
+        self.assertEqual(result.body, b"Received")
+        self.assertFalse(self.monzo.feed_called)
+
+    def test_deferred_alert_side_effects_run_by_caller(self):
+        payload = _tx_payload("tx_d1")
+        result = self.service.handle_webhook(_AUTH_HEADERS, {}, payload, defer_side_effects=True)
+        self.assertEqual(result.status_code, 200)
+        self.assertFalse(self.monzo.feed_called)
+        self.assertEqual(len(result.deferred), 2)
+
+        for task in result.deferred:
+            task()
+        self.assertTrue(self.monzo.feed_called)
+        self.assertTrue(self.monzo.note_called)
+
     def test_repeated_critical_state_alerts_on_frequency(self):
-        # alert_frequency=10 in setUp; first tx escalates (always alerts), then
+        # alert_frequency=3 here; the first tx escalates (always alerts), then
         # subsequent txs only alert every alert_frequency transactions.
-        critical_settings = self.settings.__class__(**{**self.settings.__dict__, "alert_frequency": 3})
+        critical_settings = replace(self.settings, alert_frequency=3)
         critical_monzo = _FakeMonzoClient()
         critical_monzo.balance = 5000  # below critical threshold (10000)
         critical_service = WebhookService(critical_settings, critical_monzo, MemoryStore())
 
-        headers = {"x-webhook-secret": "webhook_secret"}
-        payloads = [
-            {"type": "transaction.created", "data": {"id": "tx_c1", "account_id": "acc_test"}},
-            {"type": "transaction.created", "data": {"id": "tx_c2", "account_id": "acc_test"}},
-            {"type": "transaction.created", "data": {"id": "tx_c3", "account_id": "acc_test"}},
-            {"type": "transaction.created", "data": {"id": "tx_c4", "account_id": "acc_test"}},
-        ]
+        payloads = [_tx_payload(f"tx_c{i}") for i in range(1, 5)]
 
         for payload in payloads:
-            response = critical_service.handle_webhook(headers, {}, payload)
+            response = critical_service.handle_webhook(_AUTH_HEADERS, {}, payload)
             self.assertEqual(response.status_code, 200)
 
         # tx_c1: escalation alert; tx_c2: counter=1 (no); tx_c3: counter=2 (no); tx_c4: counter=3 (3 % 3 == 0, alert)
         self.assertEqual(critical_monzo.feed_call_count, 2)
         self.assertEqual(critical_monzo.note_call_count, 2)
+        # The token from the first webhook is reused from the in-process cache.
+        self.assertEqual(critical_monzo.refresh_count, 1)
 
     def test_repeated_warning_state_alerts_on_frequency(self):
-        warning_settings = self.settings.__class__(**{**self.settings.__dict__, "alert_frequency": 3})
+        warning_settings = replace(self.settings, alert_frequency=3)
         warning_monzo = _FakeMonzoClient()
         warning_monzo.balance = 20000
         warning_service = WebhookService(warning_settings, warning_monzo, MemoryStore())
 
-        headers = {"x-webhook-secret": "webhook_secret"}
-        payloads = [
-            {"type": "transaction.created", "data": {"id": "tx_w1", "account_id": "acc_test"}},
-            {"type": "transaction.created", "data": {"id": "tx_w2", "account_id": "acc_test"}},
-            {"type": "transaction.created", "data": {"id": "tx_w3", "account_id": "acc_test"}},
-            {"type": "transaction.created", "data": {"id": "tx_w4", "account_id": "acc_test"}},
-        ]
+        payloads = [_tx_payload(f"tx_w{i}") for i in range(1, 5)]
 
         for payload in payloads:
-            response = warning_service.handle_webhook(headers, {}, payload)
+            response = warning_service.handle_webhook(_AUTH_HEADERS, {}, payload)
             self.assertEqual(response.status_code, 200)
 
         self.assertEqual(warning_monzo.feed_call_count, 2)